@@ -1,14 +1,140 @@
 import os
+import threading
+import multiprocessing
+from hashlib import blake2b
+from concurrent.futures import ProcessPoolExecutor
+from uuid import uuid4
+
+import numpy as np
 import yaml
+
+try:
+    # C-accelerated parser (libyaml) - several times faster than the
+    # pure-Python loader on a corpus of thousands of YAML files.
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
 
+from embedding_backend import get_embeddings
+from index_store import save_index
+
 # --- CONFIGURATION ---
 # The folder where your "atomics" folder is located
 DATASET_ROOT = os.path.join(os.getcwd(), "atomics")
 # Where to save the FAISS index
 INDEX_NAME = "faiss_index"
+# How many documents the MiniLM model encodes per forward pass
+EMBED_BATCH_SIZE = 64
+# MiniLM embedding dimensionality
+EMBED_DIM = 384
+# IVF-PQ index shape: 64 inverted lists, 48 sub-quantizers of 8 bits each
+IVF_NLIST = 64
+PQ_SUBQUANTIZERS = 48
+PQ_BITS = 8
+# How many vectors to hand to index.add at a time (FAISS copies its input,
+# so small chunks keep the peak memory bounded)
+ADD_CHUNK_SIZE = 4096
+# On-disk scratch buffer for the embeddings, removed after indexing
+EMBED_SCRATCH_FILE = "embeddings_scratch.bin"
+# Longest command (in MiniLM tokens) that goes into the embedded text
+COMMAND_TOKEN_LIMIT = 128
+
+# Tokenizer is loaded lazily, once per worker process
+_tokenizer = None
+
+# Shared sentinels so the hot parse loop doesn't build a fresh default
+# dict/str per test
+_EMPTY = {}
+_UNKNOWN = "unknown"
+
+
+def truncate_command(command):
+    """Clip a command to COMMAND_TOKEN_LIMIT MiniLM tokens.
+
+    Long PowerShell one-liners blow past MiniLM's 256-token window and get
+    cut mid-word by the model anyway; clipping on token boundaries keeps
+    the semantic signal and bounds the transformer cost.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
+
+    ids = _tokenizer.encode(command, add_special_tokens=False)
+    if len(ids) <= COMMAND_TOKEN_LIMIT:
+        return command
+    return _tokenizer.decode(ids[:COMMAND_TOKEN_LIMIT])
+
+
+def parse_file(file_path):
+    """Parse one atomic YAML file into a list of (page_content, metadata) tuples.
+
+    Runs inside worker processes, so it only returns plain picklable data.
+    """
+    records = []
+
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = yaml.load(f, Loader=YamlLoader)
+
+        # Basic validation
+        if not data or 'atomic_tests' not in data:
+            return records
+
+        technique_id = data.get('attack_technique', 'Unknown')
+        technique_name = data.get('display_name', 'Unknown')
+
+        # Process each Atomic Test
+        for test in data.get('atomic_tests') or ():
+            test_name = test.get('name', 'Unnamed Test')
+            description = (test.get('description') or '').strip()
+
+            # Get supported platforms (e.g., Windows, Linux)
+            platforms = test.get('supported_platforms')
+            platform_str = ", ".join(platforms) if platforms else _UNKNOWN
+
+            # Get the execution command
+            executor = test.get('executor') or _EMPTY
+            command = executor.get('command', '')
+            executor_name = executor.get('name', _UNKNOWN)
+
+            # --- THE SPECIAL SAUCE: What goes into the Embedding? ---
+            # We combine Intent (Description) + Context (Technique).
+            # Compact labeled lines, no leading indentation - the whitespace
+            # in the old triple-quoted block cost ~5 wasted tokens per line
+            # of MiniLM's 256-token budget.
+            page_content = (
+                f"Technique: {technique_id}: {technique_name}\n"
+                f"Test Name: {test_name}\n"
+                f"Platform: {platform_str}\n"
+                f"Description: {description}\n"
+                f"Command: {truncate_command(command)}"
+            )
+
+            # --- METADATA ---
+            # In LangChain, metadata is a simple dictionary.
+            metadata = {
+                "technique_id": technique_id,
+                "technique_name": technique_name,
+                "test_name": test_name,
+                "platform": platform_str,
+                "executor": executor_name,
+                "command": command[:1000],  # Truncate if extreme
+                "source": file_path
+            }
+
+            records.append((page_content, metadata))
+
+    except Exception as e:
+        print(f" Error processing {os.path.basename(file_path)}: {e}")
+
+    return records
+
 
 def main():
     print("STARTING CYBERRAG INGESTION (Propelled by LangChain)")
@@ -24,90 +150,133 @@ def main():
         print("Make sure you are in the correct Conda environment (agentic-ai).")
         return
     
+    # Kick off the MiniLM load + warmup in the background: model init takes
+    # seconds and would otherwise serialize behind the YAML parsing phase.
+    embeddings_holder = {}
+    loader = threading.Thread(
+        target=lambda: embeddings_holder.update(
+            embeddings=get_embeddings(batch_size=EMBED_BATCH_SIZE)
+        ),
+        daemon=True,
+    )
+    loader.start()
+
     documents = []
-    
+
     print(f"Scanning dataset at: {DATASET_ROOT}")
-    count = 0
-    
-    # 1. Walk through the folder
-    for root, dirs, files in os.walk(DATASET_ROOT):
-        for file in files:
-            if file.endswith(".yaml") and file.startswith("T"):
-                file_path = os.path.join(root, file)
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = yaml.safe_load(f)
-                        
-                    # Basic validation
-                    if not data or 'atomic_tests' not in data:
-                        continue
-                        
-                    technique_id = data.get('attack_technique', 'Unknown')
-                    technique_name = data.get('display_name', 'Unknown')
-                    
-                    # 2. Process each Atomic Test
-                    for test in data.get('atomic_tests', []):
-                        test_name = test.get('name', 'Unnamed Test')
-                        description = test.get('description', '').strip()
-                        
-                        # Get supported platforms (e.g., Windows, Linux)
-                        platforms = test.get('supported_platforms', [])
-                        platform_str = ", ".join(platforms) if platforms else "unknown"
-                        
-                        # Get the execution command
-                        executor = test.get('executor', {})
-                        command = executor.get('command', '')
-                        executor_name = executor.get('name', 'unknown')
-                        
-                        # --- THE SPECIAL SAUCE: What goes into the Embedding? ---
-                        # We combine Intent (Description) + Context (Technique)
-                        page_content = f"""
-                        Technique: {technique_id}: {technique_name}
-                        Test Name: {test_name}
-                        Platform: {platform_str}
-                        Description: {description}
-                        Command: {command}
-                        """
-                        
-                        # --- METADATA ---
-                        # In LangChain, metadata is a simple dictionary.
-                        metadata = {
-                            "technique_id": technique_id,
-                            "technique_name": technique_name,
-                            "test_name": test_name,
-                            "platform": platform_str,
-                            "executor": executor_name,
-                            "command": command[:1000],  # Truncate if extreme
-                            "source": file_path
-                        }
-                        
-                        # Create LangChain Document
-                        doc = Document(page_content=page_content, metadata=metadata)
-                        documents.append(doc)
-                        count += 1
-                        
-                        if count % 100 == 0:
-                            print(f"Collected {count} tests...", end='\r')
-
-                except Exception as e:
-                    print(f" Error processing {file}: {e}")
-    
+
+    # 1. Walk through the folder and collect the YAML paths up front
+    paths = [
+        os.path.join(root, file)
+        for root, dirs, files in os.walk(DATASET_ROOT)
+        for file in files
+        if file.endswith(".yaml") and file.startswith("T")
+    ]
+    print(f"Found {len(paths)} technique files. Parsing in parallel...")
+
+    # 2. Parse the files across all cores - they are independent, and
+    # PyYAML parsing is slow enough to dominate the pre-embedding phase.
+    # Don't fork the workers: the loader thread above is mid-import of
+    # transformers/torch right now, and fork()ed children would inherit a
+    # half-initialized module whose import lock is held by a thread that
+    # doesn't exist in the child, deadlocking their first truncate_command.
+    # forkserver/spawn workers start from a clean interpreter instead.
+    mp_context = multiprocessing.get_context("spawn" if os.name == "nt" else "forkserver")
+    with ProcessPoolExecutor(mp_context=mp_context) as executor:
+        for records in executor.map(parse_file, paths, chunksize=16):
+            documents.extend(
+                Document(page_content=content, metadata=metadata)
+                for content, metadata in records
+            )
+            print(f"Collected {len(documents)} tests...", end='\r')
+
     print(f"\n Data collected. Total documents: {len(documents)}")
-    print("Initializing Embeddings (HuggingFace: all-MiniLM-L6-v2)...")
-    
-    # 3. Create Embeddings
-    # This uses the local HuggingFace model (CPU friendly, free, no API key needed)
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    
+    print("Waiting for Embeddings model (MiniLM, loaded in background)...")
+
+    # 3. Collect the Embeddings model loaded while we were parsing.
+    # Local MiniLM (CPU friendly, free, no API key needed) - INT8 ONNX
+    # when available, torch otherwise. Load synchronously if the
+    # background thread died for any reason.
+    loader.join()
+    embeddings = embeddings_holder.get("embeddings") or get_embeddings(batch_size=EMBED_BATCH_SIZE)
+
     print("Building FAISS Vector Store (This may take a moment)...")
-    
+
     # 4. Create Vector Store
-    vectorstore = FAISS.from_documents(documents, embeddings)
+    # Embed everything in one explicit batched call instead of letting
+    # FAISS.from_documents drip-feed the model: wide batches amortize the
+    # tokenizer and torch dispatch overhead per document.
+    texts = [doc.page_content for doc in documents]
+
+    # Deduplicate before embedding: many atomic tests share identical
+    # page_contents across techniques, and the encoder forward pass is the
+    # dominant cost - embed each distinct text once and fan the vector back
+    # out to every document that uses it.
+    unique_rows = {}
+    unique_texts = []
+    doc_to_unique = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        text_hash = blake2b(text.encode(), digest_size=16).digest()
+        row = unique_rows.setdefault(text_hash, len(unique_texts))
+        if row == len(unique_texts):
+            unique_texts.append(text)
+        doc_to_unique[i] = row
+    print(f"Embedding {len(unique_texts)} unique texts ({len(texts) - len(unique_texts)} duplicates skipped)...")
+
+    # Length-bucket before embedding: each batch pads to its longest member,
+    # so sorting by text length keeps batches near-uniform and stops the
+    # model burning FLOPs on pad tokens. Vectors are permuted back afterwards
+    # so the index/docstore order is unchanged.
+    order = sorted(range(len(unique_texts)), key=lambda i: len(unique_texts[i]))
+    sorted_texts = [unique_texts[i] for i in order]
+
+    # Embed batch-by-batch into an on-disk scratch buffer so we never hold
+    # all texts + torch tensors + the full vector matrix in RAM at once.
+    sorted_vectors = np.memmap(
+        EMBED_SCRATCH_FILE, dtype="float32", mode="w+", shape=(len(unique_texts), EMBED_DIM)
+    )
+    for start in range(0, len(sorted_texts), EMBED_BATCH_SIZE):
+        batch = sorted_texts[start:start + EMBED_BATCH_SIZE]
+        batch_vectors = np.asarray(embeddings.embed_documents(batch), dtype="float32")
+        # Unit-normalize so cosine similarity reduces to a plain inner
+        # product - half the ALU work of L2 per distance computation
+        faiss.normalize_L2(batch_vectors)
+        sorted_vectors[start:start + len(batch)] = batch_vectors
+
+    # IVF-PQ instead of the default flat index: PQ codes cut index memory
+    # ~10x and the inverted lists keep per-query scan cost sub-linear.
+    quantizer = faiss.IndexFlatIP(EMBED_DIM)
+    index = faiss.IndexIVFPQ(
+        quantizer, EMBED_DIM, IVF_NLIST, PQ_SUBQUANTIZERS, PQ_BITS,
+        faiss.METRIC_INNER_PRODUCT,
+    )
+    print(f"Training IVF-PQ index ({IVF_NLIST} lists, {PQ_SUBQUANTIZERS}x{PQ_BITS}-bit codes)...")
+    index.train(sorted_vectors)
+
+    # Add in document order (index positions must line up with the docstore),
+    # gathering one bounded chunk at a time - index.add copies its input
+    # internally, so feeding it the whole matrix would double peak RAM.
+    # doc_rows resolves each document through the dedup map and the
+    # length-sort permutation to its vector's row in the scratch buffer.
+    doc_rows = np.argsort(order)[doc_to_unique]
+    for start in range(0, len(doc_rows), ADD_CHUNK_SIZE):
+        index.add(np.ascontiguousarray(sorted_vectors[doc_rows[start:start + ADD_CHUNK_SIZE]]))
+
+    del sorted_vectors
+    os.remove(EMBED_SCRATCH_FILE)
+
+    doc_ids = [str(uuid4()) for _ in documents]
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(doc_ids, documents))),
+        index_to_docstore_id=dict(enumerate(doc_ids)),
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
     
-    # 5. Save Locally
+    # 5. Save Locally (streamed jsonl.zst docstore, no pickle)
     print(f" Saving FAISS index to folder: ./{INDEX_NAME}")
-    vectorstore.save_local(INDEX_NAME)
+    save_index(vectorstore, INDEX_NAME)
 
     print("\n SUCCESS! Index build complete.")
     
@@ -1,21 +1,84 @@
 import os
+import re
 import sys
-import json
+import select
+import asyncio
+import hashlib
+
+import faiss
+import orjson
+import diskcache
+import numpy as np
+from langchain_community.cache import SQLiteCache
+from langchain_core.globals import set_llm_cache
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_groq import ChatGroq
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
 
+from embedding_backend import get_embeddings
+from index_store import load_index
+
 # Load environment variables from .env file
 load_dotenv(override=True)
 
 # --- CONFIGURATION ---
 INDEX_FOLDER = "faiss_index"
 GROQ_MODEL_NAME = "llama-3.3-70b-versatile"
+# How many IVF lists to probe per search (higher = better recall, slower)
+IVF_NPROBE = 8
+# On-disk caches: SOC alerts repeat verbatim, so skip the Groq round-trip
+REWRITER_CACHE_DIR = ".rewriter_cache"
+LLM_CACHE_DB = ".groq_llm_cache.db"
+# Paste-burst batching: how many alerts to gather per pipeline pass, and
+# how long to wait for further buffered stdin lines before committing
+ALERT_BATCH_MAX = 8
+ALERT_BATCH_WINDOW = 0.05
+
+
+def read_extra_alerts(limit):
+    """Drain additional alert lines already sitting on stdin (paste bursts).
+
+    select() only works on sockets on Windows, so there we skip draining
+    and process one alert per pass - same behavior as the original loop.
+    """
+    if os.name == "nt":
+        return []
+
+    extra = []
+    try:
+        while len(extra) < limit:
+            ready, _, _ = select.select([sys.stdin], [], [], ALERT_BATCH_WINDOW)
+            if not ready:
+                break
+            line = sys.stdin.readline()
+            if not line:
+                break
+            if line.strip():
+                extra.append(line.strip())
+    except (OSError, ValueError):
+        # stdin isn't selectable (redirected/odd terminal) - no batching
+        pass
+    return extra
+
+
+def parse_rewriter_output(rewriter_output, fallback_query):
+    """Extract (enhanced_query, iocs) from the rewriter LLM's JSON reply.
+
+    Strips markdown code fences the LLM sometimes wraps around the JSON;
+    falls back to the raw query with no IOCs if parsing still fails.
+    """
+    try:
+        cleaned = re.sub(r"^```(?:json)?|```$", "", rewriter_output.strip(), flags=re.M)
+        rewriter_data = orjson.loads(cleaned)
+        return rewriter_data.get("enhanced_query", fallback_query), rewriter_data.get("iocs", {})
+    except orjson.JSONDecodeError:
+        return fallback_query, {}
+
 
-def main():
+async def main():
     print("---  CYBERRAG INTELLIGENCE TERMINAL (Dual-LLM Architecture) ---")
     
     # 1. Check API Key
@@ -30,15 +93,33 @@ def main():
     # 2. Load FAISS Index
     print(" Loading Knowledge Base (FAISS)...")
     try:
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        embeddings = get_embeddings()
         print("ℹ  Running Embeddings in CPU mode.")
-        vectorstore = FAISS.load_local(INDEX_FOLDER, embeddings, allow_dangerous_deserialization=True)
+        # mmap the index instead of FAISS.load_local: the OS pages in only
+        # the inverted lists a query touches, so cold start and RSS stay
+        # small no matter how big the corpus grows. The docstore streams
+        # in from jsonl.zst - no pickle, nothing dangerous to deserialize.
+        index, docstore, index_to_docstore_id = load_index(INDEX_FOLDER, mmap=True)
+        vectorstore = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        )
+        # The index is IVF-PQ (see ingest_atomics.py) - widen the probe a bit
+        if hasattr(vectorstore.index, "nprobe"):
+            vectorstore.index.nprobe = IVF_NPROBE
+        # Let FAISS fan the scan out across all cores (OpenMP, no GIL)
+        faiss.omp_set_num_threads(os.cpu_count())
         print(" Index loaded successfully.")
     except Exception as e:
         print(f" Failed to load index: {e}")
         return
 
     # 3. Initialize LLM
+    # Global LLM cache: identical prompts are answered from SQLite for free
+    set_llm_cache(SQLiteCache(database_path=LLM_CACHE_DB))
     print(f" Connecting to Groq Cloud ({GROQ_MODEL_NAME})...")
     try:
         llm = ChatGroq(temperature=0, model_name=GROQ_MODEL_NAME, groq_api_key=api_key)
@@ -74,6 +155,42 @@ OUTPUT (JSON only, no explanation):"""
     rewriter_prompt = PromptTemplate(template=rewriter_prompt_template, input_variables=["raw_alert"])
     rewriter_chain = rewriter_prompt | llm | StrOutputParser()
 
+    # The rewriter round-trip dominates per-query latency, and SOC alerts
+    # repeat verbatim - serve hits from diskcache and fan the misses out
+    # to Groq in one concurrent abatch call.
+    rewriter_cache = diskcache.Cache(REWRITER_CACHE_DIR)
+
+    def _cache_key(alert):
+        return hashlib.blake2b(alert.encode(), digest_size=16).hexdigest()
+
+    async def rewrite_batch(alerts):
+        outputs = [rewriter_cache.get(_cache_key(alert)) for alert in alerts]
+        misses = [i for i, output in enumerate(outputs) if output is None]
+        if misses:
+            fresh = await rewriter_chain.abatch([{"raw_alert": alerts[i]} for i in misses])
+            for i, output in zip(misses, fresh):
+                rewriter_cache[_cache_key(alerts[i])] = output
+                outputs[i] = output
+        return outputs
+
+    def search_batch(query_vectors, k=4):
+        """Search the raw FAISS index for all queries in one call.
+
+        Bypasses LangChain's per-query similarity_search wrapping so the
+        whole batch runs inside a single OpenMP-parallel index.search,
+        then joins the hits back through the docstore.
+        """
+        queries = np.ascontiguousarray(np.asarray(query_vectors, dtype="float32"))
+        faiss.normalize_L2(queries)
+        _, indices = vectorstore.index.search(queries, k)
+        return [
+            [
+                vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+                for i in row if i != -1
+            ]
+            for row in indices
+        ]
+
     # 5. LLM Chain 2: Analysis Generator
     analyst_prompt_template = """You are CyberRAG, an expert SOC Analyst trained on MITRE ATT&CK.
 
@@ -114,86 +231,95 @@ ANALYSIS:"""
         input_variables=["context", "original_alert", "iocs", "ioc_details"]
     )
 
-    print("\n SYSTEM READY. Type 'exit' to quit.\n")
+    print("\n SYSTEM READY. Type 'exit' to quit. Paste several alerts at once to batch them.\n")
 
     # 6. Interactive Loop
+    # Alerts pasted in a burst are processed as one batch: a single abatch
+    # of rewriter calls, one batched MiniLM forward pass, and one abatch of
+    # analyst calls - N serial Groq round-trips become one concurrent fan-out.
     while True:
-        query = input("\n🔎 Enter Security Alert or Question: ").strip()
-        if query.lower() in ["exit", "quit", "q"]:
+        print("\n🔎 Enter Security Alert or Question: ", end="", flush=True)
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if not line:
+            print("Shutting down.")
+            break
+
+        queries = [line.strip()] if line.strip() else []
+        queries += read_extra_alerts(ALERT_BATCH_MAX - len(queries))
+        if any(q.lower() in ["exit", "quit", "q"] for q in queries):
             print("Shutting down.")
             break
-        if not query:
+        if not queries:
             continue
 
         try:
-            # STEP 1: LLM Query Rewriter
-            print(" Step 1/3: Rewriting query with LLM...")
-            rewriter_output = rewriter_chain.invoke({"raw_alert": query})
-            
-            # Parse JSON output
-            try:
-                rewriter_data = json.loads(rewriter_output)
-                enhanced_query = rewriter_data.get("enhanced_query", query)
-                iocs = rewriter_data.get("iocs", {})
-            except json.JSONDecodeError:
-                # Fallback if LLM doesn't return valid JSON
-                enhanced_query = query
-                iocs = {}
-            
-            print(f" Enhanced Query: {enhanced_query}")
-            if iocs:
-                print(f"  Extracted IOCs: {iocs}")
-
-            # STEP 2: RAG Vector Search
+            # STEP 1: LLM Query Rewriter (batched)
+            print(f" Step 1/3: Rewriting {len(queries)} alert(s) with LLM...")
+            rewriter_outputs = await rewrite_batch(queries)
+            parsed = [
+                parse_rewriter_output(output, query)
+                for output, query in zip(rewriter_outputs, queries)
+            ]
+            for enhanced_query, iocs in parsed:
+                print(f" Enhanced Query: {enhanced_query}")
+                if iocs:
+                    print(f"  Extracted IOCs: {iocs}")
+
+            # STEP 2: RAG Vector Search (one MiniLM forward for the batch)
             print("🔄 Step 2/3: Searching knowledge base...")
-            retrieved_docs = vectorstore.similarity_search(enhanced_query, k=4)
-            
-            # Build context string
-            context_parts = []
-            for i, doc in enumerate(retrieved_docs, 1):
-                context_parts.append(f"[Source {i}] {doc.page_content}")
-            context_str = "\n\n".join(context_parts)
-
-            # STEP 3: LLM Analysis Generator
-            print("� Step 3/3: Generating analysis...")
-            
-            # Format IOC details for display
-            ioc_details = ""
-            if iocs.get("source_ip"):
-                ioc_details += f"- Source IP: {iocs['source_ip']}\n"
-            if iocs.get("dest_ip"):
-                ioc_details += f"- Destination IP: {iocs['dest_ip']}\n"
-            if iocs.get("protocol"):
-                ioc_details += f"- Protocol: {iocs['protocol']}\n"
-            if not ioc_details:
-                ioc_details = "- No IOCs extracted (clean query)\n"
-            
-            analysis = llm.invoke(
-                analyst_prompt.format(
+            enhanced_queries = [enhanced_query for enhanced_query, _ in parsed]
+            if len(enhanced_queries) == 1:
+                query_vectors = [embeddings.embed_query(enhanced_queries[0])]
+            else:
+                query_vectors = embeddings.embed_documents(enhanced_queries)
+            docs_per_query = search_batch(query_vectors)
+
+            # STEP 3: LLM Analysis Generator (batched)
+            print("� Step 3/3: Generating analyses...")
+            prompts = []
+            for query, (enhanced_query, iocs), retrieved_docs in zip(queries, parsed, docs_per_query):
+                context_str = "\n\n".join(
+                    f"[Source {i}] {doc.page_content}"
+                    for i, doc in enumerate(retrieved_docs, 1)
+                )
+
+                # Format IOC details for display
+                ioc_labels = {"source_ip": "Source IP", "dest_ip": "Destination IP", "protocol": "Protocol"}
+                ioc_details = "".join(
+                    f"- {label}: {iocs[key]}\n"
+                    for key, label in ioc_labels.items()
+                    if iocs.get(key)
+                )
+                if not ioc_details:
+                    ioc_details = "- No IOCs extracted (clean query)\n"
+
+                prompts.append(analyst_prompt.format(
                     context=context_str,
                     original_alert=query,
-                    iocs=json.dumps(iocs, indent=2),
+                    iocs=orjson.dumps(iocs, option=orjson.OPT_INDENT_2).decode(),
                     ioc_details=ioc_details
-                )
-            ).content
+                ))
+
+            analyses = await llm.abatch(prompts)
 
             # Print Results
-            print("\n" + "="*60)
-            print("📝 ANALYSIS RESULT:")
-            print("="*60)
-            print(analysis)
-            print("-" * 60)
-            
-            # Show sources
-            print("\n SOURCES USED:")
-            for i, doc in enumerate(retrieved_docs, 1):
-                technique = doc.metadata.get('technique_name', 'Unknown')
-                platform = doc.metadata.get('platform', 'Unknown')
-                print(f"[{i}] {technique} ({platform})")
-            print("="*60)
-            
+            for query, analysis, retrieved_docs in zip(queries, analyses, docs_per_query):
+                print("\n" + "="*60)
+                print(f"📝 ANALYSIS RESULT: {query}")
+                print("="*60)
+                print(analysis.content)
+                print("-" * 60)
+
+                # Show sources
+                print("\n SOURCES USED:")
+                for i, doc in enumerate(retrieved_docs, 1):
+                    technique = doc.metadata.get('technique_name', 'Unknown')
+                    platform = doc.metadata.get('platform', 'Unknown')
+                    print(f"[{i}] {technique} ({platform})")
+                print("="*60)
+
         except Exception as e:
             print(f" Error during analysis: {e}")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())